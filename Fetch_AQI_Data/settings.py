@@ -99,6 +99,9 @@ if MONGODB_URI:
 else:
     me.connect(MONGODB_DB)
 
+# Seconds before the in-process Station/Pollutant dimension cache is reloaded
+DIMENSION_CACHE_TTL = int(os.getenv('DIMENSION_CACHE_TTL', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -158,6 +161,13 @@ CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 
+# Redis used to publish newly ingested readings to the live stream endpoint
+AQI_EVENTS_REDIS_URL = os.getenv('AQI_EVENTS_REDIS_URL', CELERY_BROKER_URL)
+
+# Seconds an ingested reading may take to commit and be published; change
+# feed watermarks never go past this far behind the present
+CHANGE_FEED_SETTLE_SECONDS = int(os.getenv('CHANGE_FEED_SETTLE_SECONDS', 30))
+
 # Django REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -0,0 +1,150 @@
+"""
+National Air Quality Index (CPCB) computation.
+
+Each pollutant concentration is mapped to a sub-index by linear
+interpolation between the CPCB breakpoints; the station AQI is the highest
+sub-index and that pollutant is the dominant one. An AQI is only reported
+when at least three pollutants, one of them PM2.5 or PM10, were measured.
+"""
+from bisect import bisect_right
+
+# Index value at each breakpoint
+INDEX_BREAKPOINTS = (0, 50, 100, 200, 300, 400, 500)
+
+# Concentration at each index breakpoint, keyed by the API pollutant_id
+# (µg/m³, CO in mg/m³). The last value is where the index reaches 500.
+CONCENTRATION_BREAKPOINTS = {
+    'PM10': (0, 50, 100, 250, 350, 430, 510),
+    'PM2.5': (0, 30, 60, 90, 120, 250, 380),
+    'NO2': (0, 40, 80, 180, 280, 400, 520),
+    'OZONE': (0, 50, 100, 168, 208, 748, 1000),
+    'CO': (0, 1.0, 2.0, 10, 17, 34, 51),
+    'SO2': (0, 40, 80, 380, 800, 1600, 2000),
+    'NH3': (0, 200, 400, 800, 1200, 1800, 2400),
+}
+
+# Unit of each pollutant's breakpoints, and the size of each known
+# concentration unit in µg/m³, with units normalised by _normalise_unit
+BREAKPOINT_UNITS = dict.fromkeys(CONCENTRATION_BREAKPOINTS, 'ug/m3')
+BREAKPOINT_UNITS['CO'] = 'mg/m3'
+UNIT_SCALES = {
+    'ug/m3': 1,
+    'mg/m3': 1000,
+}
+
+CATEGORIES = (
+    (50, 'Good'),
+    (100, 'Satisfactory'),
+    (200, 'Moderate'),
+    (300, 'Poor'),
+    (400, 'Very Poor'),
+    (500, 'Severe'),
+)
+
+PARTICULATE_POLLUTANTS = ('PM2.5', 'PM10')
+MIN_POLLUTANTS = 3
+
+# Per pollutant: segment start concentrations, and (start, index start, slope)
+# per segment, so a sub-index is one bisect and one multiply-add
+_SEGMENTS = {}
+for _pollutant, _concentrations in CONCENTRATION_BREAKPOINTS.items():
+    _SEGMENTS[_pollutant] = (
+        _concentrations[:-1],
+        [
+            (
+                _concentrations[i],
+                INDEX_BREAKPOINTS[i],
+                (INDEX_BREAKPOINTS[i + 1] - INDEX_BREAKPOINTS[i]) / (_concentrations[i + 1] - _concentrations[i]),
+            )
+            for i in range(len(_concentrations) - 1)
+        ],
+    )
+
+
+def _normalise_unit(unit):
+    # 'µg/m³', 'μg/m3' and 'ug/m3' are all the same unit
+    return unit.strip().lower().replace('\u00b5', 'u').replace('\u03bc', 'u').replace('\u00b3', '3').replace(' ', '')
+
+
+def convert_to_breakpoint_unit(pollutant_id, value, unit):
+    """
+    Convert a concentration measured in ``unit`` to the unit of the
+    pollutant's breakpoints. A missing unit is taken to be the breakpoint
+    unit, as CPCB reports them; returns None for an unknown unit.
+    """
+    if not unit:
+        return value
+    scale = UNIT_SCALES.get(_normalise_unit(unit))
+    if scale is None:
+        return None
+    return value * scale / UNIT_SCALES[BREAKPOINT_UNITS[pollutant_id]]
+
+
+def sub_index(pollutant_id, value, unit=None):
+    """
+    Return the CPCB sub-index of a concentration in ``unit``, or None if the
+    pollutant has no breakpoints, the value is missing or the unit unknown
+    """
+    segments = _SEGMENTS.get(pollutant_id)
+    if segments is None or value is None:
+        return None
+    value = convert_to_breakpoint_unit(pollutant_id, value, unit)
+    if value is None or value < 0:
+        return None
+    starts, lines = segments
+    start, index_start, slope = lines[bisect_right(starts, value) - 1]
+    return min(index_start + (value - start) * slope, INDEX_BREAKPOINTS[-1])
+
+
+def category(aqi):
+    for upper, name in CATEGORIES:
+        if aqi <= upper:
+            return name
+    return CATEGORIES[-1][1]
+
+
+def station_aqi(values, units=None):
+    """
+    Compute the AQI of one station from ``{pollutant_id: value}``, with
+    concentrations in the ``{pollutant_id: unit}`` units if given.
+    Returns a dict with aqi, category, dominant_pollutant and
+    pollutant_count, or None when too few pollutants were measured.
+    """
+    units = units or {}
+    sub_indices = {}
+    for pollutant_id, value in values.items():
+        index = sub_index(pollutant_id, value, units.get(pollutant_id))
+        if index is not None:
+            sub_indices[pollutant_id] = index
+
+    if len(sub_indices) < MIN_POLLUTANTS or not any(p in sub_indices for p in PARTICULATE_POLLUTANTS):
+        return None
+
+    dominant_pollutant = max(sub_indices, key=sub_indices.get)
+    aqi = round(sub_indices[dominant_pollutant])
+    return {
+        'aqi': aqi,
+        'category': category(aqi),
+        'dominant_pollutant': dominant_pollutant,
+        'pollutant_count': len(sub_indices),
+    }
+
+
+def compute_station_aqis(readings, units=None):
+    """
+    Compute station AQIs for a batch of readings given as
+    ``(key, pollutant_id, value)`` tuples, where key identifies a station
+    and sampling time, and the ``{pollutant_id: unit}`` units they were
+    measured in. Returns ``{key: station_aqi(...)}`` for every key with
+    enough pollutants.
+    """
+    grouped = {}
+    for key, pollutant_id, value in readings:
+        grouped.setdefault(key, {})[pollutant_id] = value
+
+    results = {}
+    for key, values in grouped.items():
+        result = station_aqi(values, units)
+        if result is not None:
+            results[key] = result
+    return results
@@ -0,0 +1,204 @@
+"""
+In-process cache for the Station and Pollutant dimension documents.
+
+Ingestion resolves the descriptive fields of an API record to a station id
+and a pollutant id through this cache, and the read endpoints re-join those
+fields onto readings from it, so neither path queries the dimension
+collections per record.
+"""
+import threading
+import time
+
+from django.conf import settings
+from mongoengine.errors import DoesNotExist, NotUniqueError
+
+from .models import Station, Pollutant
+
+_lock = threading.RLock()
+_stations_by_id = {}
+_stations_by_key = {}
+_pollutants = {}
+# Ids looked up but not found since the last reload, so an unknown id
+# forces at most one reload instead of one per reading
+_missing_stations = set()
+_missing_pollutants = set()
+_loaded_at = None
+
+
+def _cache_ttl():
+    return getattr(settings, 'DIMENSION_CACHE_TTL', 300)
+
+
+def _station_key(state, city, station_name):
+    return (state or '', city or '', station_name or '')
+
+
+def _remember_station(station):
+    entry = {
+        'state': station.state,
+        'city': station.city,
+        'station_name': station.station_name,
+        'latitude': station.latitude,
+        'longitude': station.longitude,
+    }
+    _stations_by_id[station.id] = entry
+    _stations_by_key[_station_key(station.state, station.city, station.station_name)] = station.id
+
+
+def _remember_pollutant(pollutant):
+    _pollutants[pollutant.pollutant_id] = {
+        'pollutant_name': pollutant.pollutant_name,
+        'unit': pollutant.unit,
+    }
+
+
+def warm(force=False):
+    """
+    Load every station and pollutant into the cache. The cache is reloaded
+    once it is older than DIMENSION_CACHE_TTL seconds so dimensions created
+    by other workers become visible.
+    """
+    global _loaded_at
+    with _lock:
+        if not force and _loaded_at is not None and time.monotonic() - _loaded_at < _cache_ttl():
+            return
+        for station in Station.objects:
+            _remember_station(station)
+        for pollutant in Pollutant.objects:
+            _remember_pollutant(pollutant)
+        _missing_stations.clear()
+        _missing_pollutants.clear()
+        _loaded_at = time.monotonic()
+
+
+def resolve_station(parsed_data):
+    """
+    Return the id of the station described by a parsed API record,
+    creating the Station document the first time it is seen
+    """
+    key = _station_key(parsed_data['state'], parsed_data['city'], parsed_data['station_name'])
+    station_id = _stations_by_key.get(key)
+    if station_id is not None:
+        return station_id
+
+    with _lock:
+        warm()
+        station_id = _stations_by_key.get(key)
+        if station_id is not None:
+            return station_id
+
+        lookup = {'state': key[0], 'city': key[1], 'station_name': key[2]}
+        try:
+            station = Station.objects.get(**lookup)
+        except DoesNotExist:
+            station = Station(
+                latitude=parsed_data['latitude'],
+                longitude=parsed_data['longitude'],
+                **lookup
+            )
+            try:
+                station.save()
+            except NotUniqueError:
+                # Another worker created it between our lookup and insert
+                station = Station.objects.get(**lookup)
+        _remember_station(station)
+        return station.id
+
+
+def resolve_pollutant(parsed_data):
+    """
+    Return the id of the pollutant of a parsed API record,
+    creating the Pollutant document the first time it is seen
+    """
+    pollutant_id = parsed_data['pollutant_id']
+    if pollutant_id in _pollutants:
+        return pollutant_id
+
+    with _lock:
+        warm()
+        if pollutant_id not in _pollutants:
+            try:
+                pollutant = Pollutant.objects.get(pk=pollutant_id)
+            except DoesNotExist:
+                pollutant = Pollutant(
+                    pollutant_id=pollutant_id,
+                    pollutant_name=parsed_data['pollutant_name'],
+                    unit=parsed_data['unit']
+                )
+                try:
+                    pollutant.save(force_insert=True)
+                except NotUniqueError:
+                    # Another worker created it between our lookup and insert
+                    pollutant = Pollutant.objects.get(pk=pollutant_id)
+            _remember_pollutant(pollutant)
+        return pollutant_id
+
+
+def _lookup(cache, missing, key):
+    if key is None:
+        return {}
+    warm()
+    entry = cache.get(key)
+    if entry is None and key not in missing:
+        # May have been created by another worker since the last reload
+        warm(force=True)
+        entry = cache.get(key)
+        if entry is None:
+            missing.add(key)
+    return entry or {}
+
+
+def get_station(station_id):
+    """
+    Return the cached fields of a station, reloading the cache once
+    for an id that is not known yet
+    """
+    return _lookup(_stations_by_id, _missing_stations, station_id)
+
+
+def get_pollutant(pollutant_id):
+    """
+    Return the cached fields of a pollutant, reloading the cache once
+    for an id that is not known yet
+    """
+    return _lookup(_pollutants, _missing_pollutants, pollutant_id)
+
+
+def station_ids_for_state(state):
+    """
+    Return the ids of all known stations in a state
+    """
+    warm()
+    # Writers and other request threads add stations concurrently
+    with _lock:
+        return [
+            station_id for station_id, station in _stations_by_id.items()
+            if station['state'] == state
+        ]
+
+
+def join_reading(doc):
+    """
+    Re-join station and pollutant fields onto a raw AQIData document
+    (as returned by ``as_pymongo()``) for the API response
+    """
+    station = get_station(doc.get('station_id'))
+    pollutant = get_pollutant(doc.get('pollutant_id'))
+    timestamp = doc.get('timestamp')
+    return {
+        'id': str(doc['_id']),
+        'state': station.get('state'),
+        'city': station.get('city'),
+        'pollutant_id': doc.get('pollutant_id'),
+        'pollutant_name': pollutant.get('pollutant_name'),
+        'value': doc.get('value'),
+        'min_value': doc.get('min_value'),
+        'max_value': doc.get('max_value'),
+        'unit': pollutant.get('unit'),
+        'sampling_date': doc.get('sampling_date'),
+        'sampling_time': doc.get('sampling_time'),
+        'station_name': station.get('station_name'),
+        'latitude': station.get('latitude'),
+        'longitude': station.get('longitude'),
+        'timestamp': timestamp.isoformat() if timestamp else None,
+    }
@@ -0,0 +1,104 @@
+"""
+Change feed for newly ingested readings.
+
+A watermark identifies a position in the ingestion order of ``aqi_data`` as
+``<timestamp>_<object id>``; readings are ordered by (timestamp, _id), where
+timestamp is the MongoDB server time of the write that last inserted or
+changed the reading. Concurrent writes can commit slightly out of timestamp
+order, so watermarks handed to clients never go past the settled cutoff,
+CHANGE_FEED_SETTLE_SECONDS ago, by which every write stamped earlier has
+committed and been published. Readings after a watermark may therefore be
+sent again; clients de-duplicate them by id.
+Writers publish each batch of new or changed readings on a Redis channel,
+which the server-sent-events endpoint relays to connected dashboards.
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+
+import redis
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'aqi:readings'
+
+_client = None
+
+
+def make_watermark(timestamp, object_id):
+    return f'{timestamp.isoformat()}_{object_id}'
+
+
+def parse_watermark(since):
+    """
+    Parse a watermark into (timestamp, ObjectId). A bare ISO timestamp is
+    accepted too, in which case the ObjectId is None.
+    Raises ValueError for malformed values.
+    """
+    timestamp, _, object_id = since.partition('_')
+    try:
+        return datetime.fromisoformat(timestamp), ObjectId(object_id) if object_id else None
+    except InvalidId:
+        raise ValueError(f'Invalid watermark: {since}')
+
+
+def settled_cutoff():
+    """
+    Return the time up to which every ingested reading is visible
+    """
+    # Reading timestamps come from MongoDB's $$NOW, which is UTC
+    return datetime.utcnow() - timedelta(seconds=settings.CHANGE_FEED_SETTLE_SECONDS)
+
+
+def settled_watermark(watermark=None):
+    """
+    Clamp a watermark to the settled cutoff so a client resuming from it
+    cannot skip readings whose write is still in flight
+    """
+    cutoff = settled_cutoff()
+    if watermark is None or parse_watermark(watermark)[0] > cutoff:
+        return cutoff.isoformat()
+    return watermark
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.AQI_EVENTS_REDIS_URL)
+    return _client
+
+
+def publish_readings(records, watermark):
+    """
+    Publish a batch of new or changed readings (as returned by the read
+    API) to subscribers. Failures are logged and never interrupt ingestion.
+    """
+    if not records:
+        return
+    try:
+        _redis().publish(CHANNEL, json.dumps({'watermark': watermark, 'records': records}))
+    except redis.RedisError as e:
+        logger.warning(f'Could not publish {len(records)} new readings: {str(e)}')
+
+
+def subscribe():
+    """
+    Return a Redis pub/sub subscription to the readings channel.
+    The caller is responsible for closing it.
+    """
+    pubsub = _redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CHANNEL)
+    return pubsub
+
+
+def listen(pubsub, timeout=15):
+    """
+    Yield published batches from a subscription, or None every ``timeout``
+    seconds without messages so callers can send keep-alives
+    """
+    while True:
+        message = pubsub.get_message(timeout=timeout)
+        yield json.loads(message['data']) if message else None
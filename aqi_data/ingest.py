@@ -0,0 +1,364 @@
+"""
+Write path for parsed AQI records.
+
+``write_readings`` upserts a batch of parsed records keyed on station,
+pollutant and sampling time, so writing the same batch twice is harmless.
+New and changed readings are published to the change feed and the station
+AQI of every sampling time they belong to is recomputed.
+``WriteBehindQueue`` runs it on background writer threads behind a bounded
+queue, letting the fetcher keep downloading pages while MongoDB catches up.
+"""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from . import aqi, dimensions, events
+from .models import AQIData, StationAQI
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Queues with writer threads still running, drained on worker shutdown
+_active_queues = set()
+_active_lock = threading.Lock()
+
+
+READING_KEY = ('station_id', 'pollutant_id', 'sampling_date', 'sampling_time')
+READING_VALUES = ('value', 'min_value', 'max_value')
+
+
+def find_slot_readings(slots, projection=None):
+    """
+    Return the stored readings of the given
+    (station_id, sampling_date, sampling_time) slots
+    """
+    times = {}
+    for station_id, sampling_date, sampling_time in slots:
+        times.setdefault((station_id, sampling_date), set()).add(sampling_time)
+    if not times:
+        return []
+    return AQIData._get_collection().find({'$or': [
+        {'station_id': station_id, 'sampling_date': sampling_date, 'sampling_time': {'$in': sorted(slot_times)}}
+        for (station_id, sampling_date), slot_times in times.items()
+    ]}, projection)
+
+
+def write_readings(batch, aqi_slots=None, publish=True, retry_keys=None):
+    """
+    Upsert a batch of parsed records with a single bulk write.
+    Only readings that are new or whose values changed are written; they
+    are stamped with the MongoDB server time and, unless ``publish`` is
+    False (historical backfills), published to the live change feed.
+    The station AQI of their sampling slots is recomputed, unless
+    ``aqi_slots`` is given, in which case the slots are added to it for the
+    caller to recompute later. Returns the number of readings in the batch.
+
+    Callers retrying a failed write pass the same ``retry_keys`` set to
+    every attempt: readings an earlier attempt wrote before failing no
+    longer look changed, but are still published and recomputed.
+    """
+    readings = {}
+    for parsed_data in batch:
+        key = (
+            dimensions.resolve_station(parsed_data),
+            dimensions.resolve_pollutant(parsed_data),
+            parsed_data['sampling_date'],
+            parsed_data['sampling_time'],
+        )
+        readings[key] = {field: parsed_data[field] for field in READING_VALUES}
+
+    if not readings:
+        return 0
+
+    stored = {
+        tuple(doc.get(field) for field in READING_KEY): doc
+        for doc in find_slot_readings({(key[0], key[2], key[3]) for key in readings})
+    }
+    changed = [
+        key for key, values in readings.items()
+        if key not in stored or any(stored[key].get(field) != value for field, value in values.items())
+    ]
+    if retry_keys is None:
+        changed_keys = set(changed)
+    else:
+        retry_keys.update(changed)
+        changed_keys = retry_keys
+    if not changed_keys:
+        return len(readings)
+
+    if changed:
+        # $$NOW is taken by the server when the write runs, not when the batch
+        # was built, so timestamps follow commit order across writers and hosts
+        AQIData._get_collection().bulk_write([
+            UpdateOne(
+                dict(zip(READING_KEY, key)),
+                [{'$set': dict(readings[key], sampled_at=sampled_at(key[2], key[3]), timestamp='$$NOW')}],
+                upsert=True
+            )
+            for key in changed
+        ], ordered=False)
+
+    changed_slots = {(key[0], key[2], key[3]) for key in changed_keys}
+    if publish:
+        documents = sorted(
+            (
+                doc for doc in find_slot_readings(changed_slots)
+                if tuple(doc.get(field) for field in READING_KEY) in changed_keys
+            ),
+            key=lambda doc: (doc['timestamp'], doc['_id'])
+        )
+        if documents:
+            events.publish_readings(
+                [dimensions.join_reading(doc) for doc in documents],
+                events.make_watermark(documents[-1]['timestamp'], documents[-1]['_id'])
+            )
+
+    if aqi_slots is None:
+        update_station_aqi(changed_slots)
+    else:
+        aqi_slots.update(changed_slots)
+
+    return len(readings)
+
+
+def sampled_at(sampling_date, sampling_time):
+    """
+    Combine the API's 'DD-MM-YYYY' date and 'HH:MM:SS' time into a datetime
+    """
+    try:
+        return datetime.strptime(f'{sampling_date} {sampling_time}', '%d-%m-%Y %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+
+def update_station_aqi(slots):
+    """
+    Recompute the AQI of (station_id, sampling_date, sampling_time) slots
+    from all their stored readings; a batch may hold only some of a
+    station's pollutants. Each result records the newest reading timestamp
+    it saw and only replaces an AQI computed from older readings, so a
+    recompute racing with a later write cannot overwrite a fresher result.
+    """
+    readings = list(find_slot_readings(
+        slots,
+        {'station_id': 1, 'sampling_date': 1, 'sampling_time': 1, 'pollutant_id': 1, 'value': 1,
+         'timestamp': 1, '_id': 0}
+    ))
+    units = {
+        pollutant_id: dimensions.get_pollutant(pollutant_id).get('unit')
+        for pollutant_id in {reading['pollutant_id'] for reading in readings}
+    }
+    results = aqi.compute_station_aqis(
+        (((reading['station_id'], reading['sampling_date'], reading['sampling_time']),
+          reading['pollutant_id'], reading.get('value'))
+         for reading in readings),
+        units
+    )
+
+    readings_updated_at = {}
+    for reading in readings:
+        slot = (reading['station_id'], reading['sampling_date'], reading['sampling_time'])
+        if reading.get('timestamp') and (slot not in readings_updated_at or reading['timestamp'] > readings_updated_at[slot]):
+            readings_updated_at[slot] = reading['timestamp']
+
+    now = datetime.now()
+    updates = []
+    for slot, result in results.items():
+        version = readings_updated_at.get(slot)
+        updates.append((
+            {
+                'station_id': slot[0],
+                'sampling_date': slot[1],
+                'sampling_time': slot[2],
+                '$or': [
+                    {'readings_updated_at': None},
+                    {'readings_updated_at': {'$lte': version}},
+                ],
+            },
+            {'$set': dict(
+                result,
+                sampled_at=sampled_at(slot[1], slot[2]),
+                readings_updated_at=version,
+                timestamp=now
+            )}
+        ))
+    if not updates:
+        return
+
+    collection = StationAQI._get_collection()
+    try:
+        collection.bulk_write([UpdateOne(*update, upsert=True) for update in updates], ordered=False)
+    except BulkWriteError as e:
+        if e.details.get('writeConcernErrors') or any(
+            error['code'] != DUPLICATE_KEY_ERROR for error in e.details['writeErrors']
+        ):
+            raise
+        # A duplicate key means the condition did not match and the upsert
+        # tried to insert the slot: either the stored AQI came from newer
+        # readings, or a concurrent recompute inserted the slot first. Retried
+        # without upsert, the condition keeps the result from the newer readings
+        collection.bulk_write([
+            UpdateOne(*updates[error['index']]) for error in e.details['writeErrors']
+        ], ordered=False)
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of parsed record batches drained by writer threads.
+
+    ``put`` blocks while the queue is full, which throttles the fetcher to
+    the speed MongoDB accepts writes. A batch is retried until it is written
+    or ``max_retries`` is exhausted; since writes are idempotent upserts a
+    retried batch never duplicates readings. Station AQIs of the slots
+    written are recomputed once, after the writers stop, so concurrent
+    writers never compute them from partially written slots.
+    """
+
+    def __init__(self, writers=2, maxsize=8, max_retries=3, retry_delay=1.0):
+        self.writers = writers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._closed = False
+        self._aqi_slots = set()
+        self._counts_lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.writers):
+            thread = threading.Thread(target=self._run, name=f'aqi-writer-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        with _active_lock:
+            _active_queues.add(self)
+        return self
+
+    def put(self, batch):
+        if not batch:
+            return
+        if self._closed or not self._put(batch):
+            # Writers stopped (e.g. worker shutdown): write inline
+            self._write(batch)
+
+    def drain(self, timeout=None):
+        """
+        Wait for every queued batch to be written, then stop the writers.
+        With a timeout, batches still queued when it expires count as failed.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for _ in self._threads:
+            if not self._put(_STOP, deadline):
+                break
+        for thread in self._threads:
+            thread.join(self._remaining(deadline))
+
+        if any(thread.is_alive() for thread in self._threads):
+            logger.error('AQI writers did not finish before the drain timeout')
+        unwritten = self._discard_queued()
+        if unwritten:
+            logger.error(f'{unwritten} queued records were not written')
+            with self._counts_lock:
+                self.failed += unwritten
+        self._update_station_aqi()
+        with _active_lock:
+            _active_queues.discard(self)
+
+    def _update_station_aqi(self, chunk_size=500):
+        with self._counts_lock:
+            slots = list(self._aqi_slots)
+            self._aqi_slots.clear()
+        for i in range(0, len(slots), chunk_size):
+            try:
+                update_station_aqi(slots[i:i + chunk_size])
+            except Exception:
+                logger.exception(f'Updating station AQI for {len(slots[i:i + chunk_size])} slots failed')
+
+    def _remaining(self, deadline):
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    def _put(self, item, deadline=None):
+        """
+        Queue an item, waiting while the queue is full as long as a writer
+        is alive to make room and the deadline has not passed
+        """
+        while True:
+            try:
+                self._queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                if not any(thread.is_alive() for thread in self._threads):
+                    return False
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+
+    def _discard_queued(self):
+        records = 0
+        while True:
+            try:
+                batch = self._queue.get_nowait()
+            except queue.Empty:
+                return records
+            if batch is not _STOP:
+                records += len(batch)
+            self._queue.task_done()
+
+    def _run(self):
+        # Writers only stop on _STOP; any error is counted against its batch
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is _STOP:
+                    return
+                self._write(batch)
+            except Exception:
+                logger.exception(f'Unexpected error writing batch of {len(batch)} records')
+                with self._counts_lock:
+                    self.failed += len(batch)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        # Once closed, nothing recomputes collected slots, so write inline fully
+        aqi_slots = None if self._closed else set()
+        retry_keys = set()
+        for attempt in range(self.max_retries + 1):
+            try:
+                written = write_readings(batch, aqi_slots, retry_keys=retry_keys)
+            except Exception as e:
+                # Driver errors surface both as PyMongoError and, from the
+                # dimension documents, as mongoengine's OperationError
+                logger.warning(f'Writing batch of {len(batch)} records failed (attempt {attempt + 1}): {str(e)}')
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_delay * (attempt + 1))
+                continue
+            with self._counts_lock:
+                self.written += written
+                if aqi_slots:
+                    self._aqi_slots.update(aqi_slots)
+            return
+        logger.error(f'Dropping batch of {len(batch)} records after {self.max_retries + 1} attempts')
+        with self._counts_lock:
+            self.failed += len(batch)
+
+
+def drain_active_queues(timeout=None):
+    """
+    Drain every running WriteBehindQueue, used when a worker shuts down
+    """
+    with _active_lock:
+        pending = list(_active_queues)
+    for write_queue in pending:
+        write_queue.drain(timeout)
@@ -0,0 +1,314 @@
+from django.core.management.base import BaseCommand, CommandError
+from aqi_data.models import BackfillCheckpoint, FetchLog
+from aqi_data.ingest import write_readings
+from aqi_data.management.commands.fetch_aqi import parse_aqi_record
+from collections import deque
+from datetime import datetime
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import re
+
+BACKFILL_EXTENSIONS = ('.json', '.jsonl', '.csv')
+
+# Line-based formats, split into byte ranges decoded by the worker processes
+RANGED_EXTENSIONS = ('.jsonl', '.csv')
+
+# Largest .json file accepted when it is a single object rather than an array
+MAX_JSON_OBJECT_SIZE = 100 * 1024 * 1024
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+def parse_chunk(records):
+    """
+    Parse a chunk of raw API records.
+    Returns the number of rows consumed and the parsed records.
+    """
+    parsed = []
+    for record in records:
+        parsed_data = parse_aqi_record(record)
+        if parsed_data:
+            parsed.append(parsed_data)
+    return len(records), parsed
+
+
+def parse_range(path, start, end, fieldnames=None):
+    """
+    Decode and parse the lines of a .jsonl file, or of a .csv file when
+    ``fieldnames`` is given, between two byte offsets in a worker process.
+    Returns the number of rows read and the parsed records.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8-sig')
+    if fieldnames is not None:
+        records = list(csv.DictReader(io.StringIO(text, newline=''), fieldnames=fieldnames))
+    else:
+        # Split on newlines only: JSON strings may hold other line separators
+        records = [
+            record for line in text.split('\n') if line.strip()
+            for record in _page_records(json.loads(line))
+        ]
+    return parse_chunk(records)
+
+
+def iter_byte_ranges(path, start, size):
+    """
+    Yield (start, end) byte offsets of consecutive ranges of about ``size``
+    bytes, each ending at a line break
+    """
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        while start < file_size:
+            f.seek(start + size)
+            f.readline()
+            end = min(f.tell(), file_size)
+            yield start, end
+            start = end
+
+
+def read_csv_header(path):
+    """
+    Return the column names of a CSV file and the byte offset its rows start at
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        return next(csv.reader([header.decode('utf-8-sig')]), []), f.tell()
+
+
+def _page_records(item):
+    # Recorded API pages wrap their records, dumps list them directly
+    if isinstance(item, dict) and 'records' in item:
+        return item['records']
+    return [item]
+
+
+def iter_json_array(f, read_size=1 << 20):
+    """
+    Yield the elements of a top-level JSON array one at a time, reading
+    the file in blocks instead of loading it whole
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    started = False
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer):
+            char = buffer[pos]
+            if not started:
+                if char != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if char == ',':
+                pos += 1
+                continue
+            if char == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                end = None
+            if end is not None:
+                # A value is only complete once the separator after it has
+                # been read: '12345.' may continue as '12345.5' in the next block
+                after = _WHITESPACE.match(buffer, end).end()
+                if after < len(buffer) and buffer[after] in ',]':
+                    pos = end
+                    yield item
+                    continue
+                if eof and after < len(buffer):
+                    raise ValueError('Expected , or ] after JSON array element')
+        if eof:
+            raise ValueError('Unexpected end of JSON array')
+        more = f.read(read_size)
+        eof = not more
+        buffer = buffer[pos:] + more
+        pos = 0
+
+
+def _first_char(f):
+    while True:
+        char = f.read(1)
+        if not char or not char.isspace():
+            f.seek(0)
+            return char
+
+
+def iter_json_records(path):
+    """
+    Yield raw API records from a .json file holding an array of records or
+    pages, or a single page
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        if _first_char(f) == '[':
+            for item in iter_json_array(f):
+                yield from _page_records(item)
+        else:
+            # A single JSON object (one recorded page) has to be loaded whole
+            if os.path.getsize(path) > MAX_JSON_OBJECT_SIZE:
+                raise CommandError(
+                    f'{path} is a single JSON object too large to load into memory; '
+                    'convert it to a JSON array or a .jsonl file'
+                )
+            yield from _page_records(json.load(f))
+
+
+def iter_chunks(records, chunk_size):
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Backfill historical AQI data from JSON/CSV dumps or recorded API pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='+',
+            help='Files or directories of .json, .jsonl or .csv files to load',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes decoding and parsing .jsonl and .csv files',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Number of rows of a .json file parsed and written per bulk write',
+        )
+        parser.add_argument(
+            '--range-size',
+            type=int,
+            default=1024 * 1024,
+            help='Number of bytes of a .jsonl or .csv file decoded per worker task and written per bulk write',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore saved checkpoints and load every file from the start',
+        )
+
+    def handle(self, *args, **options):
+        files = self.collect_files(options['paths'])
+        if not files:
+            raise CommandError('No .json, .jsonl or .csv files found')
+
+        total_written = 0
+        with multiprocessing.Pool(processes=options['workers']) as pool:
+            for path in files:
+                total_written += self.backfill_file(pool, path, options)
+
+        FetchLog.record(
+            state='All',
+            pollutant_id='All',
+            status='success',
+            message=f'Backfilled {total_written} records from {len(files)} files',
+            records_fetched=total_written
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully backfilled {total_written} AQI records from {len(files)} files'
+            )
+        )
+
+    def collect_files(self, paths):
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    files.extend(
+                        os.path.join(root, name) for name in sorted(names)
+                        if name.lower().endswith(BACKFILL_EXTENSIONS)
+                    )
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                raise CommandError(f'File not found: {path}')
+        return [os.path.abspath(path) for path in files]
+
+    def load_checkpoint(self, path, restart):
+        stat = os.stat(path)
+        checkpoint = BackfillCheckpoint.objects(path=path).first()
+        if (
+            checkpoint is None or restart
+            or checkpoint.file_size != stat.st_size
+            or checkpoint.file_mtime != stat.st_mtime
+        ):
+            # New or modified file: start from the beginning
+            checkpoint = checkpoint or BackfillCheckpoint(path=path)
+            checkpoint.file_size = stat.st_size
+            checkpoint.file_mtime = stat.st_mtime
+            checkpoint.rows_done = 0
+            checkpoint.bytes_done = 0
+            checkpoint.completed = False
+            checkpoint.timestamp = datetime.now()
+            checkpoint.save()
+        return checkpoint
+
+    def backfill_file(self, pool, path, options):
+        checkpoint = self.load_checkpoint(path, options['restart'])
+        if checkpoint.completed:
+            self.stdout.write(f'Skipping {path}: already backfilled')
+            return 0
+        if checkpoint.rows_done:
+            self.stdout.write(f'Resuming {path} at row {checkpoint.rows_done}')
+        else:
+            self.stdout.write(f'Loading {path}')
+
+        rows_done = checkpoint.rows_done
+        written = 0
+
+        def write(row_count, parsed, bytes_done=None):
+            # Chunks are written in file order so the checkpoint only ever
+            # covers rows that are safely in MongoDB
+            nonlocal rows_done, written
+            # History is not pushed to live dashboards; pollers still get it
+            written += write_readings(parsed, publish=False)
+            rows_done += row_count
+            update = {'set__rows_done': rows_done, 'set__timestamp': datetime.now()}
+            if bytes_done is not None:
+                update['set__bytes_done'] = bytes_done
+            BackfillCheckpoint.objects(path=path).update_one(**update)
+
+        if path.lower().endswith(RANGED_EXTENSIONS):
+            fieldnames, start = None, 0
+            if path.lower().endswith('.csv'):
+                fieldnames, start = read_csv_header(path)
+            start = max(checkpoint.bytes_done, start)
+            pending = deque()
+            for start, end in iter_byte_ranges(path, start, options['range_size']):
+                pending.append((end, pool.apply_async(parse_range, (path, start, end, fieldnames))))
+                if len(pending) >= options['workers'] * 2:
+                    done, result = pending.popleft()
+                    write(*result.get(), bytes_done=done)
+            while pending:
+                done, result = pending.popleft()
+                write(*result.get(), bytes_done=done)
+        else:
+            # A JSON document can only be decoded front to back, so it is read
+            # here; handing its records to a worker would cost more than parsing
+            records = itertools.islice(iter_json_records(path), rows_done, None)
+            for chunk in iter_chunks(records, options['chunk_size']):
+                write(*parse_chunk(chunk))
+
+        BackfillCheckpoint.objects(path=path).update_one(
+            set__completed=True,
+            set__timestamp=datetime.now()
+        )
+        self.stdout.write(f'Loaded {written} records from {path} ({rows_done} rows)')
+        return written
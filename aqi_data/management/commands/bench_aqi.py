@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from aqi_data.aqi import CONCENTRATION_BREAKPOINTS, compute_station_aqis
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Benchmark National AQI computation over a synthetic national station catalogue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stations',
+            type=int,
+            default=600,
+            help='Number of stations in the synthetic catalogue',
+        )
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=24,
+            help='Number of hourly sampling times per station',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of timed runs',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed for the synthetic readings',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        pollutants = list(CONCENTRATION_BREAKPOINTS)
+
+        # Every station reports every pollutant, concentrations spread over all categories
+        readings = [
+            ((station_id, hour), pollutant_id, rng.uniform(0, CONCENTRATION_BREAKPOINTS[pollutant_id][-1]))
+            for station_id in range(options['stations'])
+            for hour in range(options['hours'])
+            for pollutant_id in pollutants
+        ]
+        self.stdout.write(
+            f'{len(readings)} readings, {options["stations"] * options["hours"]} station sampling times'
+        )
+
+        timings = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            results = compute_station_aqis(readings)
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        self.stdout.write(f'Computed {len(results)} station AQIs')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Best of {len(timings)}: {best * 1000:.1f} ms '
+                f'({len(readings) / best:,.0f} readings/s, mean {sum(timings) / len(timings) * 1000:.1f} ms)'
+            )
+        )
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 import requests
-from aqi_data.models import AQIData, FetchLog
+from aqi_data.models import FetchLog
+from aqi_data.ingest import WriteBehindQueue
 from datetime import datetime
 
 
@@ -50,8 +51,7 @@ def parse_aqi_record(record):
             'sampling_time': sampling_time,
             'station_name': record.get('station', ''),
             'latitude': record.get('latitude', ''),
-            'longitude': record.get('longitude', ''),
-            'api_response': str(record)
+            'longitude': record.get('longitude', '')
         }
     except Exception as e:
         print(f"Error parsing record: {str(e)}")
@@ -72,6 +72,24 @@ class Command(BaseCommand):
             type=str,
             help='Fetch data for a specific pollutant',
         )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=1000,
+            help='Number of records requested per API page',
+        )
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=2,
+            help='Number of threads writing parsed pages to MongoDB',
+        )
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=8,
+            help='Maximum number of parsed pages waiting to be written',
+        )
 
     def handle(self, *args, **options):
         state = options.get('state')
@@ -84,7 +102,8 @@ class Command(BaseCommand):
         params = {
             'api-key': api_key,
             'format': 'json',
-            'limit': 1000
+            'limit': options['page_size'],
+            'offset': 0
         }
         
         if state:
@@ -93,57 +112,54 @@ class Command(BaseCommand):
         if pollutant:
             params['filters[pollutant_id]'] = pollutant
 
+        # Pages are written by background threads while the next page downloads
+        write_queue = WriteBehindQueue(
+            writers=options['writers'],
+            maxsize=options['queue_size']
+        ).start()
+
         try:
-            response = requests.get(base_url, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            records_count = 0
-            
-            # Debug output
-            self.stdout.write(f'API Response Status: {response.status_code}')
-            self.stdout.write(f'Response Keys: {list(data.keys())}')
-            self.stdout.write(f'Total records available: {data.get("total", "N/A")}')
-            self.stdout.write(f'Returned records count: {len(data.get("records", []))}')
-            self.stdout.write(f'Count: {data.get("count", "N/A")}')
-            self.stdout.write(f'Status: {data.get("status", "N/A")}')
-            self.stdout.write(f'Message: {data.get("message", "N/A")}')
+            while True:
+                response = requests.get(base_url, params=params, timeout=30)
+                response.raise_for_status()
+                data = response.json()
+                records = data.get('records', [])
+                
+                if params['offset'] == 0:
+                    # Debug output
+                    self.stdout.write(f'API Response Status: {response.status_code}')
+                    self.stdout.write(f'Response Keys: {list(data.keys())}')
+                    self.stdout.write(f'Total records available: {data.get("total", "N/A")}')
+                    self.stdout.write(f'Returned records count: {len(records)}')
+                    self.stdout.write(f'Count: {data.get("count", "N/A")}')
+                    self.stdout.write(f'Status: {data.get("status", "N/A")}')
+                    self.stdout.write(f'Message: {data.get("message", "N/A")}')
+                
+                batch = []
+                for record in records:
+                    parsed_data = parse_aqi_record(record)
+                    if parsed_data:
+                        batch.append(parsed_data)
+                
+                # Blocks while the writers are behind
+                write_queue.put(batch)
+                
+                params['offset'] += len(records)
+                if not records or params['offset'] >= int(data.get('total') or 0):
+                    break
             
-            if 'records' in data:
-                for record in data['records']:
-                    # Parse and save AQI data
-                    try:
-                        parsed_data = parse_aqi_record(record)
-                        if parsed_data:
-                            aqi_data = AQIData(
-                                state=parsed_data['state'],
-                                city=parsed_data['city'],
-                                pollutant_id=parsed_data['pollutant_id'],
-                                pollutant_name=parsed_data['pollutant_name'],
-                                value=parsed_data['value'],
-                                min_value=parsed_data['min_value'],
-                                max_value=parsed_data['max_value'],
-                                unit=parsed_data['unit'],
-                                sampling_date=parsed_data['sampling_date'],
-                                sampling_time=parsed_data['sampling_time'],
-                                station_name=parsed_data['station_name'],
-                                latitude=parsed_data['latitude'],
-                                longitude=parsed_data['longitude'],
-                                api_response=parsed_data['api_response']
-                            )
-                            aqi_data.save()
-                            records_count += 1
-                    except Exception as e:
-                        self.stdout.write(f"Error storing record: {str(e)}")
+            write_queue.drain()
+            records_count = write_queue.written
             
             # Log the fetch
-            FetchLog(
+            FetchLog.record(
                 state=state or 'All',
                 pollutant_id=pollutant or 'All',
-                status='success',
-                message=f'Successfully fetched {records_count} records',
+                status='failed' if write_queue.failed else 'success',
+                message=f'Successfully fetched {records_count} records'
+                        + (f', {write_queue.failed} records could not be stored' if write_queue.failed else ''),
                 records_fetched=records_count
-            ).save()
+            )
             
             self.stdout.write(
                 self.style.SUCCESS(
@@ -152,28 +168,30 @@ class Command(BaseCommand):
             )
         
         except requests.exceptions.RequestException as e:
+            write_queue.drain()
             error_msg = f'Failed to fetch AQI data: {str(e)}'
-            FetchLog(
+            FetchLog.record(
                 state=state or 'All',
                 pollutant_id=pollutant or 'All',
                 status='failed',
                 message=error_msg,
-                records_fetched=0
-            ).save()
+                records_fetched=write_queue.written
+            )
             
             self.stdout.write(
                 self.style.ERROR(error_msg)
             )
         
         except Exception as e:
+            write_queue.drain()
             error_msg = f'Error processing AQI data: {str(e)}'
-            FetchLog(
+            FetchLog.record(
                 state=state or 'All',
                 pollutant_id=pollutant or 'All',
                 status='failed',
                 message=error_msg,
-                records_fetched=0
-            ).save()
+                records_fetched=write_queue.written
+            )
             
             self.stdout.write(
                 self.style.ERROR(error_msg)
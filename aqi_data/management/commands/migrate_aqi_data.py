@@ -0,0 +1,174 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from aqi_data.models import AQIData, FetchLog, FetchLogSummary, StationAQI
+from aqi_data import dimensions
+
+# Fields readings carried before station and pollutant details moved to
+# the Station and Pollutant documents
+LEGACY_READING_FIELDS = (
+    'state',
+    'city',
+    'station_name',
+    'latitude',
+    'longitude',
+    'pollutant_name',
+    'unit',
+    'api_response',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Migrate the aqi_data collection to the current schema and build its '
+        'indexes. Safe to run repeatedly; run it after every deploy, before '
+        'starting the Celery workers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of readings updated per bulk write',
+        )
+        parser.add_argument(
+            '--rebuild-fetch-summary',
+            action='store_true',
+            help='Recompute the per-status fetch counters from the stored fetch logs '
+                 '(run once when upgrading; logs older than the TTL are no longer counted)',
+        )
+
+    def handle(self, *args, **options):
+        # Order matters: the unique reading index can only be built once every
+        # reading has a station_id and duplicates are gone
+        self.migrate_legacy_readings(options['batch_size'])
+        self.remove_duplicate_readings(options['batch_size'])
+        self.set_reading_sampled_at()
+        AQIData.ensure_indexes()
+        self.stdout.write(self.style.SUCCESS('Built aqi_data indexes'))
+        # mongoengine only ever creates indexes, so replaced ones are dropped here
+        for document in (AQIData, FetchLog, StationAQI):
+            self.drop_obsolete_indexes(document)
+        if options['rebuild_fetch_summary']:
+            self.rebuild_fetch_summary()
+
+    def migrate_legacy_readings(self, batch_size):
+        """
+        Create Station and Pollutant documents from the fields stored on
+        legacy readings, set their station_id and drop the old fields
+        """
+        collection = AQIData._get_collection()
+        legacy_readings = collection.find(
+            {'station_id': {'$exists': False}},
+            {field: 1 for field in LEGACY_READING_FIELDS + ('pollutant_id',)}
+        )
+
+        migrated = 0
+        operations = []
+        for reading in legacy_readings:
+            parsed_data = {
+                field: reading.get(field) or ''
+                for field in LEGACY_READING_FIELDS + ('pollutant_id',)
+            }
+            dimensions.resolve_pollutant(parsed_data)
+            operations.append(UpdateOne(
+                {'_id': reading['_id']},
+                {
+                    '$set': {'station_id': dimensions.resolve_station(parsed_data)},
+                    '$unset': {field: '' for field in LEGACY_READING_FIELDS},
+                }
+            ))
+            if len(operations) >= batch_size:
+                migrated += collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            migrated += collection.bulk_write(operations, ordered=False).modified_count
+
+        self.stdout.write(self.style.SUCCESS(f'Migrated {migrated} legacy readings to station ids'))
+
+    def remove_duplicate_readings(self, batch_size):
+        """
+        Keep only the most recently stored reading for each station,
+        pollutant and sampling time
+        """
+        collection = AQIData._get_collection()
+        duplicates = collection.aggregate([
+            {'$sort': {'timestamp': -1}},
+            {'$group': {
+                '_id': {
+                    'station_id': '$station_id',
+                    'pollutant_id': '$pollutant_id',
+                    'sampling_date': '$sampling_date',
+                    'sampling_time': '$sampling_time',
+                },
+                'ids': {'$push': '$_id'},
+                'count': {'$sum': 1},
+            }},
+            {'$match': {'count': {'$gt': 1}}},
+        ], allowDiskUse=True)
+
+        removed = 0
+        stale_ids = []
+        for group in duplicates:
+            stale_ids.extend(group['ids'][1:])
+            if len(stale_ids) >= batch_size:
+                removed += collection.delete_many({'_id': {'$in': stale_ids}}).deleted_count
+                stale_ids = []
+        if stale_ids:
+            removed += collection.delete_many({'_id': {'$in': stale_ids}}).deleted_count
+
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} duplicate readings'))
+
+    def set_reading_sampled_at(self):
+        """
+        Store the sampling date and time of readings written before
+        sampled_at existed as a datetime, which the read API sorts on
+        """
+        result = AQIData._get_collection().update_many(
+            {'sampled_at': {'$exists': False}},
+            [{'$set': {'sampled_at': {'$dateFromString': {
+                'dateString': {'$concat': ['$sampling_date', ' ', '$sampling_time']},
+                'format': '%d-%m-%Y %H:%M:%S',
+                'onError': None,
+                'onNull': None,
+            }}}}]
+        )
+        self.stdout.write(self.style.SUCCESS(f'Set sampling time on {result.modified_count} readings'))
+
+    def drop_obsolete_indexes(self, document):
+        """
+        Drop indexes on the collection that the document no longer declares
+        """
+        collection = document._get_collection()
+        extra = document.compare_indexes()['extra']
+        for name, info in collection.index_information().items():
+            if name != '_id_' and info['key'] in extra:
+                collection.drop_index(name)
+                self.stdout.write(f'Dropped index {name} from {collection.name}')
+
+    def rebuild_fetch_summary(self):
+        """
+        Recompute the FetchLogSummary counters from the fetch logs
+        """
+        summaries = FetchLog._get_collection().aggregate([
+            {'$sort': {'timestamp': 1}},
+            {'$group': {
+                '_id': '$status',
+                'count': {'$sum': 1},
+                'records_fetched': {'$sum': '$records_fetched'},
+                'last_timestamp': {'$last': '$timestamp'},
+                'last_message': {'$last': '$message'},
+            }},
+        ], allowDiskUse=True)
+
+        for summary in summaries:
+            if summary['_id'] is None:
+                continue
+            FetchLogSummary.objects(status=summary['_id']).update_one(
+                set__count=summary['count'],
+                set__records_fetched=summary['records_fetched'],
+                set__last_timestamp=summary['last_timestamp'],
+                set__last_message=summary['last_message'],
+                upsert=True
+            )
+        self.stdout.write(self.style.SUCCESS('Rebuilt fetch log summary'))
@@ -1,41 +1,120 @@
-from mongoengine import Document, StringField, FloatField, DateTimeField, IntField
+from mongoengine import Document, StringField, FloatField, DateTimeField, IntField, SequenceField, BooleanField
 from datetime import datetime
 
 
-class AQIData(Document):
+class Station(Document):
     """
-    MongoDB Document for storing AQI data fetched from the government API
+    MongoDB Document for a monitoring station (dimension shared by all readings)
     """
+    id = SequenceField(primary_key=True)  # compact integer id stored on readings
     state = StringField(required=True)
     city = StringField()
-    pollutant_id = StringField(required=True)
+    station_name = StringField()
+    latitude = StringField()
+    longitude = StringField()
+
+    meta = {
+        'collection': 'stations',
+        'indexes': [
+            {'fields': ('state', 'city', 'station_name'), 'unique': True},
+        ]
+    }
+
+    def __str__(self):
+        return f"{self.id}: {self.station_name} ({self.city}, {self.state})"
+
+
+class Pollutant(Document):
+    """
+    MongoDB Document for a pollutant (dimension shared by all readings)
+    """
+    pollutant_id = StringField(primary_key=True)  # e.g. 'PM2.5', 'NO2'
     pollutant_name = StringField()
+    unit = StringField()
+
+    meta = {
+        'collection': 'pollutants'
+    }
+
+    def __str__(self):
+        return f"{self.pollutant_id} ({self.unit})"
+
+
+class AQIData(Document):
+    """
+    MongoDB Document for storing AQI data fetched from the government API.
+    Station and pollutant details live in the Station and Pollutant
+    documents; a reading only keeps their ids next to the measured values.
+    """
+    station_id = IntField(required=True)
+    pollutant_id = StringField(required=True)
     value = FloatField()  # avg_value from API
     min_value = FloatField()
     max_value = FloatField()
-    unit = StringField()
     sampling_date = StringField()
     sampling_time = StringField()
-    station_name = StringField()
-    latitude = StringField()
-    longitude = StringField()
+    sampled_at = DateTimeField()  # sampling_date and sampling_time as a datetime
     timestamp = DateTimeField(default=datetime.now, required=True)
-    api_response = StringField()  # Store raw JSON response for reference
-    
+
     meta = {
         'collection': 'aqi_data',
+        # Built by the migrate_aqi_data command once legacy readings have
+        # station ids and duplicates are removed; building the unique index
+        # before that fails and would break every query on the collection
+        'auto_create_index': False,
         'indexes': [
-            'state',
-            'city',
+            # One reading per station, pollutant and sampling time; ingestion
+            # upserts on this key so replayed batches stay idempotent. Led by
+            # the sampling slot so all pollutants of a slot are one index range
+            {
+                'fields': ('station_id', 'sampling_date', 'sampling_time', 'pollutant_id'),
+                'unique': True
+            },
             'pollutant_id',
-            ('state', 'pollutant_id'),
-            'timestamp',
-            '-timestamp'
+            # Sampling order, used by the read API for the latest readings
+            ('-sampled_at', '-id'),
+            # Ingestion order, used by the since= cursor and the change feed
+            ('timestamp', 'id')
         ]
     }
-    
+
+    def __str__(self):
+        return f"{self.station_id} - {self.pollutant_id}: {self.value} at {self.timestamp}"
+
+
+class StationAQI(Document):
+    """
+    MongoDB Document for the National AQI of a station at one sampling time,
+    computed from its AQIData readings during ingestion
+    """
+    station_id = IntField(required=True)
+    sampling_date = StringField()
+    sampling_time = StringField()
+    sampled_at = DateTimeField()  # sampling_date and sampling_time as a datetime
+    aqi = IntField()
+    category = StringField()
+    dominant_pollutant = StringField()
+    pollutant_count = IntField()
+    readings_updated_at = DateTimeField()  # newest reading timestamp used
+    timestamp = DateTimeField(default=datetime.now, required=True)
+
+    meta = {
+        'collection': 'station_aqi',
+        'indexes': [
+            {
+                'fields': ('station_id', 'sampling_date', 'sampling_time'),
+                'unique': True
+            },
+            '-sampled_at'
+        ]
+    }
+
     def __str__(self):
-        return f"{self.state} - {self.city} - {self.pollutant_id}: {self.value} at {self.timestamp}"
+        return f"{self.station_id}: AQI {self.aqi} ({self.dominant_pollutant}) at {self.sampling_date} {self.sampling_time}"
+
+
+# Fetch logs are removed by MongoDB once they are older than this
+FETCH_LOG_TTL_SECONDS = 30 * 24 * 60 * 60
 
 
 class FetchLog(Document):
@@ -52,11 +131,73 @@ class FetchLog(Document):
     meta = {
         'collection': 'fetch_logs',
         'indexes': [
-            'state',
-            'pollutant_id',
-            '-timestamp'
+            # Serves the state filter and the -timestamp sort of FetchLogsView
+            ('state', '-timestamp'),
+            {'fields': ['timestamp'], 'expireAfterSeconds': FETCH_LOG_TTL_SECONDS}
         ]
     }
     
     def __str__(self):
         return f"{self.state} - {self.pollutant_id}: {self.status} at {self.timestamp}"
+
+    @classmethod
+    def record(cls, state, pollutant_id, status, message, records_fetched=0):
+        """
+        Insert a fetch log and update the running per-status summary
+        """
+        log = cls(
+            state=state,
+            pollutant_id=pollutant_id,
+            status=status,
+            message=message,
+            records_fetched=records_fetched
+        )
+        cls.objects.insert(log, load_bulk=False)
+        FetchLogSummary.objects(status=status).update_one(
+            inc__count=1,
+            inc__records_fetched=records_fetched,
+            set__last_timestamp=log.timestamp,
+            set__last_message=message,
+            upsert=True
+        )
+        return log
+
+
+class FetchLogSummary(Document):
+    """
+    MongoDB Document keeping running totals of fetch operations per status.
+    Counters start from the logs written through FetchLog.record; run
+    ``migrate_aqi_data --rebuild-fetch-summary`` to include older logs.
+    """
+    status = StringField(primary_key=True)
+    count = IntField(default=0)
+    records_fetched = IntField(default=0)
+    last_timestamp = DateTimeField()
+    last_message = StringField()
+
+    meta = {
+        'collection': 'fetch_log_summary'
+    }
+
+    def __str__(self):
+        return f"{self.status}: {self.count} fetches"
+
+
+class BackfillCheckpoint(Document):
+    """
+    MongoDB Document tracking how far a backfill has got through a file
+    """
+    path = StringField(required=True, unique=True)
+    file_size = IntField()
+    file_mtime = FloatField()
+    rows_done = IntField(default=0)
+    bytes_done = IntField(default=0)  # resume offset of .jsonl and .csv files
+    completed = BooleanField(default=False)
+    timestamp = DateTimeField(default=datetime.now, required=True)
+
+    meta = {
+        'collection': 'backfill_checkpoints'
+    }
+
+    def __str__(self):
+        return f"{self.path}: {self.rows_done} rows{' (completed)' if self.completed else ''}"
@@ -1,5 +1,7 @@
 from celery import shared_task
+from celery.signals import worker_process_shutdown, worker_shutting_down
 from django.core.management import call_command
+from .ingest import drain_active_queues
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,3 +20,14 @@ def fetch_aqi_task():
     except Exception as e:
         logger.error(f'Error in hourly AQI fetch: {str(e)}')
         return f'Error: {str(e)}'
+
+
+@worker_shutting_down.connect
+@worker_process_shutdown.connect
+def drain_ingest_queues(**kwargs):
+    """
+    Flush parsed batches still waiting in write-behind queues before the
+    worker (or pool process) exits
+    """
+    logger.info('Worker shutting down, draining AQI write queues...')
+    drain_active_queues(timeout=60)
@@ -0,0 +1,172 @@
+import io
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.test import SimpleTestCase, override_settings
+
+from aqi_data import aqi, events
+from aqi_data.management.commands.backfill_aqi import iter_json_array
+
+
+class IterJsonArrayTests(SimpleTestCase):
+    """
+    Streaming decoder used by backfill_aqi for .json arrays
+    """
+    items = [
+        {'state': 'Delhi', 'avg_value': '95', 'records': [{'a': 1}, {'b': [2, 3]}]},
+        'a string with ] and , inside',
+        12345.5,
+        [],
+        None,
+        {'nested': {'deep': ['x' * 50]}},
+    ]
+
+    def test_elements_split_across_read_blocks(self):
+        text = json.dumps(self.items, indent=2)
+        for read_size in (1, 2, 3, 7, 64, 1 << 20):
+            with self.subTest(read_size=read_size):
+                self.assertEqual(list(iter_json_array(io.StringIO(text), read_size)), self.items)
+
+    def test_number_split_at_block_boundary(self):
+        # '[12' '345' '.5]' must decode as one number, not 12 or 12345
+        self.assertEqual(list(iter_json_array(io.StringIO('[12345.5]'), read_size=3)), [12345.5])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array(io.StringIO('  [ ]  '), read_size=1)), [])
+
+    def test_truncated_array(self):
+        for text in ('[{"a": 1}, {"b":', '[1, 2', '['):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    list(iter_json_array(io.StringIO(text), read_size=4))
+
+    def test_missing_separator(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[1 2]'), read_size=2))
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('{"records": []}')))
+
+
+class WatermarkTests(SimpleTestCase):
+    """
+    Change feed watermarks handed to clients as ``since``
+    """
+    object_id = ObjectId('65d1f0a2c3b4a5d6e7f80912')
+
+    def test_round_trip(self):
+        timestamp = datetime(2026, 2, 17, 21, 0, 5, 123000)
+        watermark = events.make_watermark(timestamp, self.object_id)
+        self.assertEqual(events.parse_watermark(watermark), (timestamp, self.object_id))
+
+    def test_bare_timestamp(self):
+        self.assertEqual(
+            events.parse_watermark('2026-02-17T21:00:00'),
+            (datetime(2026, 2, 17, 21, 0), None)
+        )
+
+    def test_malformed_watermarks(self):
+        for since in ('', 'yesterday', '17-02-2026 21:00:00', '2026-02-17T21:00:00_not-an-id',
+                      '2026-02-30T21:00:00_65d1f0a2c3b4a5d6e7f80912'):
+            with self.subTest(since=since):
+                with self.assertRaises(ValueError):
+                    events.parse_watermark(since)
+
+    @override_settings(CHANGE_FEED_SETTLE_SECONDS=30)
+    def test_settled_watermark_keeps_older_watermark(self):
+        watermark = events.make_watermark(datetime.utcnow() - timedelta(minutes=5), self.object_id)
+        self.assertEqual(events.settled_watermark(watermark), watermark)
+
+    @override_settings(CHANGE_FEED_SETTLE_SECONDS=30)
+    def test_settled_watermark_clamps_recent_watermark(self):
+        before = datetime.utcnow() - timedelta(seconds=30)
+        watermark = events.make_watermark(datetime.utcnow(), self.object_id)
+        settled, object_id = events.parse_watermark(events.settled_watermark(watermark))
+        self.assertIsNone(object_id)
+        self.assertGreaterEqual(settled, before)
+        self.assertLessEqual(settled, datetime.utcnow() - timedelta(seconds=30))
+
+    @override_settings(CHANGE_FEED_SETTLE_SECONDS=30)
+    def test_settled_watermark_without_watermark(self):
+        settled, object_id = events.parse_watermark(events.settled_watermark())
+        self.assertIsNone(object_id)
+        self.assertLessEqual(settled, datetime.utcnow() - timedelta(seconds=30))
+
+    def test_settled_watermark_rejects_malformed_watermark(self):
+        with self.assertRaises(ValueError):
+            events.settled_watermark('not a watermark')
+
+
+class SubIndexTests(SimpleTestCase):
+    """
+    CPCB sub-index interpolation
+    """
+
+    def test_breakpoint_boundaries(self):
+        for concentration, index in zip(aqi.CONCENTRATION_BREAKPOINTS['PM2.5'], aqi.INDEX_BREAKPOINTS):
+            with self.subTest(concentration=concentration):
+                self.assertAlmostEqual(aqi.sub_index('PM2.5', concentration), index)
+
+    def test_interpolates_within_segment(self):
+        self.assertAlmostEqual(aqi.sub_index('PM2.5', 45), 75)
+        self.assertAlmostEqual(aqi.sub_index('PM10', 300), 250)
+        self.assertAlmostEqual(aqi.sub_index('CO', 1.5), 75)
+
+    def test_capped_above_last_breakpoint(self):
+        self.assertEqual(aqi.sub_index('PM2.5', 1000), 500)
+
+    def test_missing_values(self):
+        self.assertIsNone(aqi.sub_index('PM2.5', None))
+        self.assertIsNone(aqi.sub_index('PM2.5', -1))
+        self.assertIsNone(aqi.sub_index('BENZENE', 5))
+
+    def test_units(self):
+        self.assertAlmostEqual(aqi.sub_index('CO', 1500, 'µg/m³'), 75)
+        self.assertAlmostEqual(aqi.sub_index('CO', 1.5, 'mg/m3'), 75)
+        self.assertAlmostEqual(aqi.sub_index('PM2.5', 0.045, 'mg/m³'), 75)
+        self.assertAlmostEqual(aqi.sub_index('PM2.5', 45, 'ug/m3'), 75)
+        self.assertAlmostEqual(aqi.sub_index('PM2.5', 45, ''), 75)
+        self.assertIsNone(aqi.sub_index('PM2.5', 45, 'ppm'))
+
+
+class StationAQITests(SimpleTestCase):
+    """
+    Station AQI from the sub-indices of its pollutants
+    """
+
+    def test_dominant_pollutant(self):
+        self.assertEqual(aqi.station_aqi({'PM2.5': 95, 'NO2': 30, 'OZONE': 50}), {
+            'aqi': 217,
+            'category': 'Poor',
+            'dominant_pollutant': 'PM2.5',
+            'pollutant_count': 3,
+        })
+
+    def test_requires_three_pollutants(self):
+        self.assertIsNone(aqi.station_aqi({'PM2.5': 95, 'NO2': 30}))
+        self.assertIsNone(aqi.station_aqi({'PM2.5': 95, 'NO2': 30, 'OZONE': None}))
+
+    def test_requires_particulate_matter(self):
+        self.assertIsNone(aqi.station_aqi({'NO2': 30, 'OZONE': 50, 'SO2': 20, 'CO': 1.0}))
+        self.assertIsNotNone(aqi.station_aqi({'PM10': 80, 'NO2': 30, 'SO2': 20}))
+
+    def test_units_per_pollutant(self):
+        result = aqi.station_aqi({'PM10': 80, 'NO2': 30, 'CO': 25000}, {'CO': 'µg/m³'})
+        self.assertEqual(result['dominant_pollutant'], 'CO')
+        self.assertEqual(result['aqi'], 347)
+
+    def test_categories(self):
+        for value, name in ((0, 'Good'), (50, 'Good'), (51, 'Satisfactory'), (300, 'Poor'), (500, 'Severe')):
+            with self.subTest(aqi=value):
+                self.assertEqual(aqi.category(value), name)
+
+    def test_compute_station_aqis_groups_by_key(self):
+        readings = [
+            ('a', 'PM2.5', 45), ('a', 'NO2', 30), ('a', 'SO2', 20),
+            ('b', 'PM2.5', 45), ('b', 'NO2', 30),
+        ]
+        results = aqi.compute_station_aqis(readings)
+        self.assertEqual(list(results), ['a'])
+        self.assertEqual(results['a']['aqi'], 75)
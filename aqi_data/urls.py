@@ -3,6 +3,9 @@ from . import views
 
 urlpatterns = [
     path('api-data/', views.APIDataView.as_view(), name='api-data'),  # Returns data from DB only
+    path('api-data/stream/', views.AQIDataStreamView.as_view(), name='api-data-stream'),  # Server-sent events
+    path('station-aqi/', views.StationAQIView.as_view(), name='station-aqi'),  # Latest National AQI per station
     path('aqi-data/', views.AQIDataListView.as_view(), name='aqi-data-list'),
     path('fetch-logs/', views.FetchLogsView.as_view(), name='fetch-logs'),
+    path('fetch-logs/summary/', views.FetchLogSummaryView.as_view(), name='fetch-logs-summary'),
 ]
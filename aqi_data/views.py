@@ -1,11 +1,16 @@
 from django.shortcuts import render
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from mongoengine import Q
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import AQIData, FetchLog
+from .models import AQIData, FetchLog, FetchLogSummary, StationAQI
+from . import dimensions, events
+from .ingest import write_readings
 import json
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 def parse_aqi_record(record):
@@ -54,55 +59,138 @@ def parse_aqi_record(record):
             'sampling_time': sampling_time,
             'station_name': record.get('station', ''),
             'latitude': record.get('latitude', ''),
-            'longitude': record.get('longitude', ''),
-            'api_response': str(record)
+            'longitude': record.get('longitude', '')
         }
     except Exception as e:
         print(f"Error parsing record: {str(e)}")
         return None
 
 
+def readings_after(since, query_filter, settled=True):
+    """
+    Return readings ingested after a watermark, oldest first. Unless
+    ``settled`` is False, readings past the settled cutoff are left for
+    the next poll so writes still in flight cannot be skipped.
+    """
+    timestamp, object_id = events.parse_watermark(since)
+    after = Q(timestamp__gt=timestamp)
+    if object_id is not None:
+        after |= Q(timestamp=timestamp, id__gt=object_id)
+    if settled:
+        after &= Q(timestamp__lte=events.settled_cutoff())
+    return AQIData.objects(after, **query_filter).order_by('timestamp', 'id')
+
+
+def build_query_filter(state, pollutant_id):
+    query_filter = {}
+    if state:
+        query_filter['station_id__in'] = dimensions.station_ids_for_state(state)
+    if pollutant_id:
+        query_filter['pollutant_id'] = pollutant_id
+    return query_filter
+
+
 class APIDataView(APIView):
     """
     API endpoint to retrieve AQI data from the database only.
     This is called by the UI to get cached data fetched automatically every hour.
+    Pass the returned ``watermark`` back as ``since`` to get only newer or
+    changed readings; readings near the watermark may repeat, so
+    de-duplicate them by id.
     """
     def get(self, request):
         state = request.query_params.get('state')
         pollutant_id = request.query_params.get('pollutant_id')
+        since = request.query_params.get('since')
+        limit = int(request.query_params.get('limit', 100000))
+        
+        if since:
+            try:
+                events.parse_watermark(since)
+            except ValueError as e:
+                return Response({
+                    'status': 'error',
+                    'message': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            query_filter = build_query_filter(state, pollutant_id)
+            
+            if since:
+                # Only readings newer than the watermark, oldest first
+                aqi_records = readings_after(since, query_filter)
+            else:
+                # Query from database, latest sampling time first; backfilled
+                # history is written late but sampled long ago
+                aqi_records = AQIData.objects(**query_filter).order_by('-sampled_at', '-id')
+            aqi_records = list(aqi_records[:limit].as_pymongo())
+            
+            # Re-join station and pollutant details from the dimension cache
+            result = [dimensions.join_reading(record) for record in aqi_records]
+            
+            watermark = since
+            if aqi_records:
+                newest = max(aqi_records, key=lambda record: (record['timestamp'], record['_id']))
+                watermark = events.settled_watermark(events.make_watermark(newest['timestamp'], newest['_id']))
+            
+            return Response({
+                'status': 'success',
+                'count': len(result),
+                'watermark': watermark,
+                'records': result
+            }, status=status.HTTP_200_OK)
+        
+        except Exception as e:
+            return Response({
+                'status': 'error',
+                'message': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class StationAQIView(APIView):
+    """
+    API endpoint returning the latest National AQI of each station,
+    computed during ingestion
+    """
+    def get(self, request):
+        state = request.query_params.get('state')
         limit = int(request.query_params.get('limit', 100000))
         
         try:
-            # Build query filter
             query_filter = {}
             if state:
-                query_filter['state'] = state
-            if pollutant_id:
-                query_filter['pollutant_id'] = pollutant_id
+                query_filter['station_id__in'] = dimensions.station_ids_for_state(state)
             
-            # Query from database, sorted by latest timestamp
-            aqi_records = AQIData.objects(**query_filter).order_by('-timestamp')[:limit]
+            # Only look at AQIs sampled within a day of the newest one
+            newest = StationAQI.objects(**query_filter).order_by('-sampled_at').only('sampled_at').first()
+            if newest and newest.sampled_at:
+                query_filter['sampled_at__gte'] = newest.sampled_at - timedelta(hours=24)
+            station_aqis = StationAQI.objects(**query_filter).order_by('-sampled_at').as_pymongo()
             
-            # Format response data
+            # Keep only the most recent AQI per station
             result = []
-            for record in aqi_records:
+            seen_stations = set()
+            for station_aqi in station_aqis:
+                if station_aqi['station_id'] in seen_stations:
+                    continue
+                seen_stations.add(station_aqi['station_id'])
+                station = dimensions.get_station(station_aqi['station_id'])
                 result.append({
-                    'id': str(record.id),
-                    'state': record.state,
-                    'city': record.city,
-                    'pollutant_id': record.pollutant_id,
-                    'pollutant_name': record.pollutant_name,
-                    'value': record.value,
-                    'min_value': record.min_value,
-                    'max_value': record.max_value,
-                    'unit': record.unit,
-                    'sampling_date': record.sampling_date,
-                    'sampling_time': record.sampling_time,
-                    'station_name': record.station_name,
-                    'latitude': record.latitude,
-                    'longitude': record.longitude,
-                    'timestamp': record.timestamp.isoformat() if record.timestamp else None,
+                    'station_id': station_aqi['station_id'],
+                    'state': station.get('state'),
+                    'city': station.get('city'),
+                    'station_name': station.get('station_name'),
+                    'latitude': station.get('latitude'),
+                    'longitude': station.get('longitude'),
+                    'aqi': station_aqi.get('aqi'),
+                    'category': station_aqi.get('category'),
+                    'dominant_pollutant': station_aqi.get('dominant_pollutant'),
+                    'pollutant_count': station_aqi.get('pollutant_count'),
+                    'sampling_date': station_aqi.get('sampling_date'),
+                    'sampling_time': station_aqi.get('sampling_time'),
                 })
+                if len(result) >= limit:
+                    break
             
             return Response({
                 'status': 'success',
@@ -117,6 +205,88 @@ class APIDataView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class AQIDataStreamView(View):
+    """
+    Server-sent events endpoint pushing new and changed readings as they are
+    ingested. Clients resume from ``since`` or the Last-Event-ID header after
+    a reconnect and should de-duplicate readings by id.
+
+    Each connection is an endless synchronous stream: under WSGI it holds a
+    worker thread for as long as the dashboard stays open, and Django 4.0's
+    ASGI handler iterates sync streams on the event loop. Serve it from
+    workers sized for the number of open dashboards.
+    """
+    catch_up_batch_size = 1000
+
+    def get(self, request):
+        state = request.GET.get('state')
+        pollutant_id = request.GET.get('pollutant_id')
+        since = request.GET.get('since') or request.headers.get('Last-Event-ID')
+        
+        if since:
+            try:
+                events.parse_watermark(since)
+            except ValueError as e:
+                return JsonResponse({
+                    'status': 'error',
+                    'message': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = StreamingHttpResponse(
+            self.event_stream(since, state, pollutant_id),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def format_event(self, records, watermark):
+        return f'id: {watermark}\nevent: readings\ndata: {json.dumps(records)}\n\n'
+
+    def event_stream(self, since, state, pollutant_id):
+        # Subscribe before catching up so batches published meanwhile are not lost
+        pubsub = events.subscribe()
+        # Writes published to the subscription are all stamped after this
+        subscribed_at = events.settled_cutoff()
+        try:
+            # Reading versions sent while catching up that may be published
+            # again; a later update of a reading carries a new timestamp
+            sent_versions = {}
+            
+            if since:
+                # The subscription covers everything committed from now on, so
+                # the catch-up can read right up to the present
+                query_filter = build_query_filter(state, pollutant_id)
+                while True:
+                    aqi_records = list(
+                        readings_after(since, query_filter, settled=False)[:self.catch_up_batch_size].as_pymongo()
+                    )
+                    if not aqi_records:
+                        break
+                    records = [dimensions.join_reading(record) for record in aqi_records]
+                    sent_versions.update(
+                        (record['id'], record['timestamp']) for record, aqi_record in zip(records, aqi_records)
+                        if aqi_record['timestamp'] > subscribed_at
+                    )
+                    since = events.make_watermark(aqi_records[-1]['timestamp'], aqi_records[-1]['_id'])
+                    yield self.format_event(records, events.settled_watermark(since))
+            
+            for message in events.listen(pubsub):
+                if message is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                records = [
+                    record for record in message['records']
+                    if sent_versions.get(record['id']) != record['timestamp']
+                    and (not state or record['state'] == state)
+                    and (not pollutant_id or record['pollutant_id'] == pollutant_id)
+                ]
+                if records:
+                    yield self.format_event(records, events.settled_watermark(message['watermark']))
+        finally:
+            pubsub.close()
+
+
 class AQIDataListView(APIView):
     """
     API endpoint to retrieve AQI data from data.gov.in API
@@ -158,30 +328,11 @@ class AQIDataListView(APIView):
             
             result = []
             if 'records' in api_data:
+                parsed_batch = []
                 for record in api_data['records']:
-                    # Parse and store record in database
-                    try:
-                        parsed_data = parse_aqi_record(record)
-                        if parsed_data:
-                            aqi_data = AQIData(
-                                state=parsed_data['state'],
-                                city=parsed_data['city'],
-                                pollutant_id=parsed_data['pollutant_id'],
-                                pollutant_name=parsed_data['pollutant_name'],
-                                value=parsed_data['value'],
-                                min_value=parsed_data['min_value'],
-                                max_value=parsed_data['max_value'],
-                                unit=parsed_data['unit'],
-                                sampling_date=parsed_data['sampling_date'],
-                                sampling_time=parsed_data['sampling_time'],
-                                station_name=parsed_data['station_name'],
-                                latitude=parsed_data['latitude'],
-                                longitude=parsed_data['longitude'],
-                                api_response=parsed_data['api_response']
-                            )
-                            aqi_data.save()
-                    except Exception as e:
-                        print(f"Error storing record: {str(e)}")
+                    parsed_data = parse_aqi_record(record)
+                    if parsed_data:
+                        parsed_batch.append(parsed_data)
                     
                     result.append({
                         'country': record.get('country', ''),
@@ -196,6 +347,12 @@ class AQIDataListView(APIView):
                         'max_value': record.get('max_value', ''),
                         'avg_value': record.get('avg_value', ''),
                     })
+                
+                # Store all parsed records with one bulk upsert
+                try:
+                    write_readings(parsed_batch)
+                except Exception as e:
+                    print(f"Error storing records: {str(e)}")
             
             return Response({
                 'status': 'success',
@@ -236,3 +393,22 @@ class FetchLogsView(APIView):
             return Response(result, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class FetchLogSummaryView(APIView):
+    """
+    API endpoint returning fetch totals per status from running counters
+    """
+    def get(self, request):
+        try:
+            result = {}
+            for summary in FetchLogSummary.objects:
+                result[summary.status] = {
+                    'count': summary.count,
+                    'records_fetched': summary.records_fetched,
+                    'last_message': summary.last_message,
+                    'last_timestamp': summary.last_timestamp.isoformat() if summary.last_timestamp else None
+                }
+            return Response(result, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)